@@ -0,0 +1,42 @@
+import hashlib
+import re
+
+from PIL import Image, ImageOps
+
+# размеры производных аватарок (квадрат, px) и их формат
+AVATAR_SIZES = (64, 128, 256)
+AVATAR_QUALITY = 82
+
+# имя производной: avatar_<id пользователя>_<хеш содержимого>_<размер>.webp — хеш делает URL неизменяемым
+DERIVATIVE_RE = re.compile(r"^(avatar_\d+_[0-9a-f]{16})_(\d+)\.webp$")
+
+
+def derivative_name(key: str, size: int) -> str:
+    return f"{key}_{size}.webp"
+
+
+def derivative_names(key: str) -> list:
+    return [derivative_name(key, size) for size in AVATAR_SIZES]
+
+
+def key_from_name(name: str):
+    match = DERIVATIVE_RE.match(name or "")
+    return match.group(1) if match else None
+
+
+def make_derivatives(source_path: str, user_id: int, upload_dir: str = "uploads") -> str:
+    """Один раз декодирует загруженную картинку и пишет WebP всех размеров без метаданных. Возвращает ключ."""
+    largest = max(AVATAR_SIZES)
+    with Image.open(source_path) as img:
+        # для JPEG декодер сразу уменьшает картинку кратно 1/2..1/8 — 10 МБ фото не разворачивается целиком
+        img.draft("RGB", (largest * 2, largest * 2))
+        img = ImageOps.exif_transpose(img)
+        img = img.convert("RGBA" if img.mode in ("RGBA", "LA", "P") else "RGB")
+        square = ImageOps.fit(img, (largest, largest), Image.LANCZOS)
+
+    key = f"avatar_{user_id}_{hashlib.sha256(square.tobytes()).hexdigest()[:16]}"
+    for size in AVATAR_SIZES:
+        resized = square if size == largest else square.resize((size, size), Image.LANCZOS)
+        # exif/icc не передаём — Pillow пишет файл без метаданных
+        resized.save(f"{upload_dir}/{derivative_name(key, size)}", "WEBP", quality=AVATAR_QUALITY, method=6)
+    return key
@@ -0,0 +1,269 @@
+"""
+Массовый импорт материалов (например, архив нового университета).
+
+    python -m backend.import_materials архив/ --author admin@example.com --course 1 --type ЛК
+    python -m backend.import_materials manifest.csv
+
+Манифест (.csv, .json или .jsonl) — строки с полями title, category, course, type, author (email),
+files (пути через ";" относительно манифеста) и необязательными description, is_private.
+Для каталога каждый файл становится отдельным материалом: название — имя файла,
+предмет — папка первого уровня (или --category).
+
+Файлы хешируются и копируются в uploads/ параллельно, текст извлекается в пуле процессов,
+строки Material/MaterialFile вставляются пачками. Импорт можно перезапускать после сбоя:
+материалы, чьи файлы (по sha256) у этого автора уже есть в базе, пропускаются.
+"""
+import argparse
+import csv
+import hashlib
+import json
+import os
+import shutil
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from datetime import datetime
+
+from sqlalchemy import insert
+
+from backend.database import SessionLocal, engine
+from backend import models
+from backend.text_extract import extract_text_from_file
+
+UPLOAD_DIR = "uploads"
+CHUNK = 1024 * 1024
+DESCRIPTION_LENGTH = 500
+
+
+def capitalize(value: str) -> str:
+    value = (value or "").strip()
+    return value[0].upper() + value[1:] if value else value
+
+
+def read_manifest(path: str) -> list:
+    base = os.path.dirname(os.path.abspath(path))
+    if path.endswith(".csv"):
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            rows = list(csv.DictReader(f))
+    elif path.endswith(".jsonl"):
+        with open(path, encoding="utf-8") as f:
+            rows = [json.loads(line) for line in f if line.strip()]
+    else:
+        with open(path, encoding="utf-8") as f:
+            rows = json.load(f)
+
+    entries = []
+    for row in rows:
+        files = row.get("files") or row.get("file") or []
+        if isinstance(files, str):
+            files = [p.strip() for p in files.split(";") if p.strip()]
+        if not isinstance(files, list) or not all(isinstance(p, str) for p in files):
+            files = []  # строка будет пропущена при проверке как строка без файлов
+        entries.append({
+            "title": row.get("title"), "category": row.get("category"), "course": row.get("course"),
+            "type": row.get("type"), "author": row.get("author"), "description": row.get("description") or "",
+            "is_private": row.get("is_private"),
+            "files": [os.path.join(base, p) for p in files]
+        })
+    return entries
+
+
+def scan_directory(root: str, args) -> list:
+    entries = []
+    for dirpath, _, filenames in os.walk(root):
+        rel = os.path.relpath(dirpath, root)
+        category = args.category or (rel.split(os.sep)[0] if rel != "." else "Без предмета")
+        for name in sorted(filenames):
+            if name.startswith("."): continue
+            entries.append({
+                "title": os.path.splitext(name)[0], "category": category, "course": args.course,
+                "type": args.type, "author": None, "description": "", "is_private": False,
+                "files": [os.path.join(dirpath, name)]
+            })
+    return entries
+
+
+def hash_file(path: str) -> tuple:
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, "rb") as f:
+        while True:
+            block = f.read(CHUNK)
+            if not block: break
+            digest.update(block)
+            size += len(block)
+    return digest.hexdigest(), size
+
+
+def stored_name(path: str, sha256: str) -> str:
+    # имя по содержимому: повторный запуск не плодит копии
+    return f"{sha256[:16]}_{os.path.basename(path)}"
+
+
+def copy_file(path: str, sha256: str, size: int) -> str:
+    name = stored_name(path, sha256)
+    dest = os.path.join(UPLOAD_DIR, name)
+    if os.path.exists(dest) and os.path.getsize(dest) == size:
+        return name
+    tmp = f"{dest}.{uuid.uuid4().hex}.part"
+    shutil.copyfile(path, tmp)
+    os.replace(tmp, dest)
+    return name
+
+
+def parse_course(value):
+    if isinstance(value, int) and not isinstance(value, bool):
+        course = value
+    elif isinstance(value, str) and value.strip().isdigit():
+        course = int(value)
+    else:
+        return None
+    return course if course >= 1 else None
+
+
+def parse_flag(value):
+    if isinstance(value, bool):
+        return value
+    if value is None or value in (0, 1):
+        return bool(value)
+    text = str(value).strip().lower()
+    if text in ("", "0", "false", "no"): return False
+    if text in ("1", "true", "yes"): return True
+    return None
+
+
+def make_description(text: str) -> str:
+    text = " ".join(text.split())
+    return text[:DESCRIPTION_LENGTH]
+
+
+def import_batch(db, batch: list, threads, processes) -> tuple:
+    """Копирует файлы пачки, извлекает текст и вставляет строки. Возвращает (материалов, файлов, байт)."""
+    copy_jobs = [(e, i, path) for e in batch for i, path in enumerate(e["files"])]
+    names = list(threads.map(lambda job: copy_file(job[2], *job[0]["hashes"][job[1]]), copy_jobs))
+    for (e, i, _), name in zip(copy_jobs, names):
+        e.setdefault("stored", {})[i] = name
+
+    # описание из текста первого файла, если в манифесте его нет
+    need_text = [e for e in batch if not e["description"]]
+    texts = processes.map(extract_text_from_file, [e["stored"][0] for e in need_text], chunksize=8)
+    for e, text in zip(need_text, texts):
+        e["description"] = make_description(text)
+
+    now = datetime.utcnow()
+    material_rows = [{
+        "title": capitalize(e["title"]), "category": capitalize(e["category"]), "course": e["course"],
+        "material_type": e["type"], "description": e["description"], "is_private": e["is_private"],
+        "author_id": e["author_id"], "likes_count": 0, "downloads_count": 0, "views_count": 0,
+        "trending_score": 0, "created_at": now
+    } for e in batch]
+    ids = db.execute(
+        insert(models.Material).returning(models.Material.id, sort_by_parameter_order=True), material_rows
+    ).scalars().all()
+
+    file_rows = []
+    total_bytes = 0
+    for e, material_id in zip(batch, ids):
+        for i, path in enumerate(e["files"]):
+            sha256, size = e["hashes"][i]
+            total_bytes += size
+            file_rows.append({
+                "material_id": material_id, "filename": os.path.basename(path), "file_path": e["stored"][i],
+                "file_size": f"{size / 1024 / 1024:.2f} MB", "sha256": sha256
+            })
+    db.execute(insert(models.MaterialFile), file_rows)
+    db.commit()
+
+    # имя файла определяется содержимым, и на него может лежать "надгробие" от удалённого материала:
+    # фоновый сборщик мог удалить файл между копированием и коммитом — после коммита он уже защищён ссылкой
+    for e in batch:
+        for i, path in enumerate(e["files"]):
+            if not os.path.exists(os.path.join(UPLOAD_DIR, e["stored"][i])):
+                copy_file(path, *e["hashes"][i])
+    return len(batch), len(file_rows), total_bytes
+
+
+def run(args):
+    start = time.monotonic()
+    if os.path.isdir(args.source):
+        entries = scan_directory(args.source, args)
+    else:
+        entries = read_manifest(args.source)
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    models.init_schema(engine)
+
+    db = SessionLocal()
+    threads = ThreadPoolExecutor(max_workers=args.threads)
+    processes = ProcessPoolExecutor(max_workers=args.processes)
+    try:
+        emails = {e["author"] or args.author for e in entries} - {None}
+        authors = dict(db.query(models.User.email, models.User.id).filter(models.User.email.in_(emails)).all())
+
+        valid = []
+        for e in entries:
+            e["author_id"] = authors.get(e["author"] or args.author)
+            e["course"] = parse_course(e["course"] or args.course)
+            e["type"] = e["type"] or args.type
+            e["is_private"] = parse_flag(e["is_private"])
+            missing = [p for p in e["files"] if not os.path.isfile(p)]
+            if not e["author_id"]:
+                print(f"Пропуск «{e['title']}»: автор {e['author'] or args.author} не найден")
+            elif e["course"] is None or e["is_private"] is None or not isinstance(e["type"], str):
+                print(f"Пропуск «{e['title']}»: некорректные course, type или is_private")
+            elif not all(isinstance(e[field], str) for field in ("title", "category", "description")):
+                print(f"Пропуск «{e['title']}»: title, category и description должны быть строками")
+            elif not e["title"] or not e["category"] or not e["files"] or missing:
+                print(f"Пропуск «{e['title']}»: не хватает полей или файлов {missing}")
+            else:
+                valid.append(e)
+
+        # хеши считаем параллельно: по ним же определяем, что уже импортировано
+        paths = sorted({p for e in valid for p in e["files"]})
+        hashes = dict(zip(paths, threads.map(hash_file, paths)))
+        for e in valid:
+            e["hashes"] = [hashes[p] for p in e["files"]]
+
+        done = set(db.query(models.Material.author_id, models.MaterialFile.sha256)
+                   .join(models.MaterialFile, models.MaterialFile.material_id == models.Material.id)
+                   .filter(models.MaterialFile.sha256.in_({h for h, _ in hashes.values()})).all())
+        pending = [e for e in valid if not all((e["author_id"], h) in done for h, _ in e["hashes"])]
+        print(f"Найдено {len(entries)}, к импорту {len(pending)}, уже загружено {len(valid) - len(pending)}")
+
+        materials = files = total_bytes = 0
+        for offset in range(0, len(pending), args.batch_size):
+            m, f, b = import_batch(db, pending[offset:offset + args.batch_size], threads, processes)
+            materials, files, total_bytes = materials + m, files + f, total_bytes + b
+            elapsed = time.monotonic() - start
+            print(f"{materials}/{len(pending)} материалов, {files} файлов, "
+                  f"{total_bytes / 1024 / 1024:.1f} MB — {files / elapsed:.1f} файлов/с, "
+                  f"{total_bytes / 1024 / 1024 / elapsed:.1f} MB/с")
+    finally:
+        threads.shutdown()
+        processes.shutdown()
+        db.close()
+
+    elapsed = max(time.monotonic() - start, 1e-6)
+    print(f"Готово за {elapsed:.1f} с: {materials} материалов ({materials / elapsed:.1f}/с), "
+          f"{files} файлов, {total_bytes / 1024 / 1024:.1f} MB")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Массовый импорт материалов в Agora")
+    parser.add_argument("source", help="каталог с файлами или манифест (.csv/.json/.jsonl)")
+    parser.add_argument("--author", help="email автора по умолчанию (обязателен для каталога)")
+    parser.add_argument("--category", help="предмет для всех файлов каталога")
+    parser.add_argument("--course", type=int, default=1)
+    parser.add_argument("--type", default="ЛК", help="тип материала: ЛК, ЛР, РГР, Курсовая")
+    parser.add_argument("--batch-size", type=int, default=200)
+    parser.add_argument("--threads", type=int, default=8, help="потоки для хеширования и копирования")
+    parser.add_argument("--processes", type=int, default=os.cpu_count(), help="процессы для извлечения текста")
+    args = parser.parse_args(argv)
+
+    if os.path.isdir(args.source) and not args.author:
+        parser.error("для импорта каталога нужен --author")
+    run(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
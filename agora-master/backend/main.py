@@ -1,28 +1,32 @@
 import shutil
 import os
+import asyncio
 import uuid
 import json
 import bcrypt
 import random
+from html import escape
 from typing import List  # <--- ВАЖНО: Добавили List для мульти-загрузки
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 from fastapi import FastAPI, Depends, HTTPException, File, UploadFile, Form, Request, BackgroundTasks
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import RedirectResponse, FileResponse
-from sqlalchemy.orm import Session
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import text, exists
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session, joinedload
 from fastapi_mail import FastMail, MessageSchema, ConnectionConfig, MessageType
 from gigachat import GigaChat
-import PyPDF2
-import docx
 from dotenv import load_dotenv
 
 load_dotenv()
 
-from backend.database import get_db, engine
-from backend import models
+from backend.database import get_db, engine, SessionLocal
+from backend import models, recommendations, schemas, avatars
+from backend.text_extract import extract_text_from_file
 
-models.Base.metadata.create_all(bind=engine)
+models.init_schema(engine)
 
 app = FastAPI()
 
@@ -33,6 +37,46 @@ app.mount("/static", StaticFiles(directory="uploads"), name="static")
 
 templates = Jinja2Templates(directory="/app/backend/templates")
 
+# фоновые периодические задачи (запускаются вместе с приложением)
+PERIODIC_JOBS = []
+# ссылки на запущенные задачи: иначе asyncio может собрать их сборщиком мусора
+RUNNING_JOBS = set()
+
+
+def periodic(interval_seconds: int, first_delay_seconds: int = 0):
+    def decorator(func):
+        PERIODIC_JOBS.append((interval_seconds, first_delay_seconds, func))
+        return func
+    return decorator
+
+
+async def run_periodically(interval_seconds: int, first_delay_seconds: int, func):
+    await asyncio.sleep(first_delay_seconds)
+    while True:
+        try:
+            if asyncio.iscoroutinefunction(func):
+                await func()
+            else:
+                await run_in_threadpool(func)
+        except Exception as e:
+            print(f"Ошибка фоновой задачи {func.__name__}: {e}")
+        await asyncio.sleep(interval_seconds)
+
+
+@app.on_event("startup")
+async def start_periodic_jobs():
+    for interval_seconds, first_delay_seconds, func in PERIODIC_JOBS:
+        task = asyncio.create_task(run_periodically(interval_seconds, first_delay_seconds, func))
+        RUNNING_JOBS.add(task)
+        task.add_done_callback(RUNNING_JOBS.discard)
+
+
+@app.on_event("shutdown")
+async def stop_periodic_jobs():
+    for task in list(RUNNING_JOBS):
+        task.cancel()
+    await asyncio.gather(*RUNNING_JOBS, return_exceptions=True)
+
 # почта
 conf = ConnectionConfig(
     MAIL_USERNAME=os.getenv("MAIL_USERNAME"),
@@ -99,6 +143,82 @@ async def send_reset_email(email: str, code: str):
     await fm.send_message(message)
 
 
+async def send_deadline_reminder_email(email: str, name: str, tasks: list):
+    items = "".join(
+        f'<li style="margin-bottom: 8px;"><b>{escape(t["text"] or "")}</b>'
+        f'{" — " + escape(t["subject"]) if t["subject"] else ""}<br>'
+        f'<span style="color: #dc2626;">до {t["deadline"]}</span></li>'
+        for t in tasks
+    )
+    html = f"""
+    <div style="font-family: sans-serif; max-width: 500px; margin: 0 auto;">
+        <h2 style="color: #007EC6;">Agora.</h2>
+        <p>{escape(name or "")}, скоро дедлайн:</p>
+        <ul style="padding-left: 20px;">{items}</ul>
+    </div>
+    """
+    message = MessageSchema(
+        subject="Напоминание о дедлайне",
+        recipients=[email],
+        body=html,
+        subtype=MessageType.html
+    )
+    fm = FastMail(conf)
+    await fm.send_message(message)
+
+
+# аватарки: оригинал сразу сохраняется как есть, уменьшенные копии делает фоновая process_avatar
+AVATAR_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+def avatar_url_for(user: models.User, size: int = 128):
+    if user.avatar_key:
+        return f"/avatars/{avatars.derivative_name(user.avatar_key, size)}"
+    return f"/static/{user.avatar_url}" if user.avatar_url else None
+
+
+def avatar_urls(user: models.User) -> dict:
+    return {size: avatar_url_for(user, size) for size in avatars.AVATAR_SIZES} if user.avatar_url else {}
+
+
+def process_avatar(user_id: int, filename: str):
+    try:
+        key = avatars.make_derivatives(f"uploads/{filename}", user_id)
+    except Exception as e:
+        print(f"Ошибка обработки аватарки: {e}")
+        return
+
+    db = SessionLocal()
+    try:
+        user = db.query(models.User).filter(models.User.id == user_id).first()
+        if not user or user.avatar_url != filename:
+            # пока обрабатывали, аватарку успели заменить — эти копии не нужны
+            if not user or user.avatar_key != key:
+                for derivative in avatars.derivative_names(key): schedule_file_deletion(db, derivative)
+        else:
+            schedule_file_deletion(db, filename)
+            user.avatar_key = key
+            user.avatar_url = avatars.derivative_name(key, max(avatars.AVATAR_SIZES))
+        db.commit()
+    finally:
+        db.close()
+
+
+@app.get("/avatars/{name}")
+def get_avatar(name: str):
+    if not avatars.key_from_name(name) or not os.path.exists(f"uploads/{name}"):
+        raise HTTPException(status_code=404, detail="Нет такой аватарки")
+    # имя содержит хеш содержимого, поэтому файл можно кешировать навсегда
+    return FileResponse(f"uploads/{name}", media_type="image/webp",
+                        headers={"Cache-Control": AVATAR_CACHE_CONTROL})
+
+
+# файлы удаляем не сразу, а через "надгробия": они фиксируются в той же транзакции,
+# а физически файлы удаляет фоновый reap_deleted_files
+def schedule_file_deletion(db: Session, file_path: str):
+    db.add(models.FileTombstone(file_path=file_path))
+
+
 # маршруты
 
 @app.get("/")
@@ -178,14 +298,9 @@ def dashboard_page(request: Request, email: str = None, db: Session = Depends(ge
 
     if not user: return RedirectResponse(url="/")
 
-    avatar_link = f"/static/{user.avatar_url}" if user.avatar_url else None
+    avatar_link = avatar_url_for(user, 256)
 
-    privacy_dict = {"email": False, "bio": True, "uni": True, "tg": True}
-    if user.privacy_settings:
-        try:
-            privacy_dict = json.loads(user.privacy_settings)
-        except:
-            pass
+    privacy_dict = user.privacy_settings or schemas.PrivacySettings().model_dump()
 
     total_materials = len(user.materials)
     total_likes = sum(m.likes_count for m in user.materials)
@@ -209,60 +324,71 @@ def dashboard_page(request: Request, email: str = None, db: Session = Depends(ge
         "id": user.id, "name": user.username, "email": user.email,
         "university": user.university or "Не указан", "course": str(user.course) if user.course else "1",
         "bio": user.bio or "Информация о себе не заполнена", "telegram": user.telegram or "",
-        "age": user.age or "", "avatarUrl": avatar_link,
+        "age": user.age or "", "avatarUrl": avatar_link, "avatars": avatar_urls(user),
         "downloads": total_materials,
         "rating": f"{rating_val:.1f}",
         "privacy": privacy_dict,
-        "favCats": json.loads(user.fav_categories) if user.fav_categories else [],
+        "favCats": user.fav_categories or [],
         "tasks": tasks_list
     }
 
+    sync_cursor = make_sync_cursor()
     materials_db = db.query(models.Material).all()
-
-    my_ai_entries = db.query(models.UserAI).filter(models.UserAI.user_id == user.id).all()
-    ai_map = {entry.material_id: entry.summary_text for entry in my_ai_entries}
-
-    my_likes = db.query(models.UserLike.material_id).filter(models.UserLike.user_id == user.id).all()
-    my_likes_ids = [like[0] for like in my_likes]
-
-    my_favs = db.query(models.UserFavorite.material_id).filter(models.UserFavorite.user_id == user.id).all()
-    my_favs_ids = [fav[0] for fav in my_favs]  # Список ID избранных файлов
-
-    materials_data = []
-    for m in materials_db:
-        author_name = m.author.username if m.author else "Неизвестный"
-        personal_ai = ai_map.get(m.id)
-
-        files_list = []
-        for f in m.files:
-            files_list.append({
-                "id": f.id,
-                "name": f.filename,
-                "path": f.file_path,
-                "size": f.file_size,
-                "ext": f.filename.split('.')[-1].lower() if '.' in f.filename else 'file'
-            })
-
-        materials_data.append({
-            "id": m.id, "title": m.title, "author": author_name, "authorId": m.author_id,
-            "category": m.category, "date": m.created_at.strftime("%d.%m.%Y"),
-            "type": m.material_type, "course": m.course, "likes": m.likes_count,
-            "isLiked": m.id in my_likes_ids,
-            "isFav": m.id in my_favs_ids,
-            "ai": personal_ai, "aiStatus": "ready" if personal_ai else "none",
-            "desc": m.description,
-            "isPrivate": m.is_private,
-            "downloads": m.downloads_count, "views": m.views_count,
-            "files": files_list
-        })
+    ai_map, my_likes_ids, my_favs_ids = user_material_marks(db, user.id)
+    materials_data = [serialize_material(m, ai_map, my_likes_ids, my_favs_ids) for m in materials_db]
 
     return templates.TemplateResponse("dashboard.html", {
         "request": request,
         "user_json": json.dumps(user_data, ensure_ascii=False),
-        "materials_json": json.dumps(materials_data, ensure_ascii=False)
+        "materials_json": json.dumps(materials_data, ensure_ascii=False),
+        "sync_cursor": sync_cursor
     })
 
 
+def user_material_marks(db: Session, user_id: int, material_ids=None):
+    """Персональные отметки пользователя: (AI-выжимки по id, id лайкнутых, id избранных)."""
+    ai_query = db.query(models.UserAI).filter(models.UserAI.user_id == user_id)
+    likes_query = db.query(models.UserLike.material_id).filter(models.UserLike.user_id == user_id)
+    favs_query = db.query(models.UserFavorite.material_id).filter(models.UserFavorite.user_id == user_id)
+    if material_ids is not None:
+        ai_query = ai_query.filter(models.UserAI.material_id.in_(material_ids))
+        likes_query = likes_query.filter(models.UserLike.material_id.in_(material_ids))
+        favs_query = favs_query.filter(models.UserFavorite.material_id.in_(material_ids))
+
+    ai_map = {entry.material_id: entry.summary_text for entry in ai_query.all()}
+    my_likes_ids = {like[0] for like in likes_query.all()}
+    my_favs_ids = {fav[0] for fav in favs_query.all()}  # ID избранных файлов
+    return ai_map, my_likes_ids, my_favs_ids
+
+
+def serialize_material(m: models.Material, ai_map: dict, my_likes_ids: set, my_favs_ids: set) -> dict:
+    author_name = m.author.username if m.author else "Неизвестный"
+    personal_ai = ai_map.get(m.id)
+
+    files_list = []
+    for f in m.files:
+        files_list.append({
+            "id": f.id,
+            "name": f.filename,
+            "path": f.file_path,
+            "size": f.file_size,
+            "ext": f.filename.split('.')[-1].lower() if '.' in f.filename else 'file'
+        })
+
+    return {
+        "id": m.id, "title": m.title, "author": author_name, "authorId": m.author_id,
+        "category": m.category, "date": m.created_at.strftime("%d.%m.%Y"),
+        "type": m.material_type, "course": m.course, "likes": m.likes_count,
+        "isLiked": m.id in my_likes_ids,
+        "isFav": m.id in my_favs_ids,
+        "ai": personal_ai, "aiStatus": "ready" if personal_ai else "none",
+        "desc": m.description,
+        "isPrivate": m.is_private,
+        "downloads": m.downloads_count, "views": m.views_count,
+        "files": files_list
+    }
+
+
 # 5. ЗАГРУЗКА МАТЕРИАЛОВ
 @app.post("/upload")
 def upload_material(
@@ -319,6 +445,8 @@ def upload_material(
         )
         db.add(new_file)
 
+    # файлы добавлены отдельным коммитом — отмечаем материал изменённым прямо перед ним для /api/sync
+    new_material.updated_at = datetime.utcnow()
     db.commit()
     return RedirectResponse(url=f"/dashboard?email={author.email}", status_code=303)
 
@@ -362,6 +490,7 @@ def reset_password_final(email: str = Form(...), code: str = Form(...), new_pass
 # 7. ОБНОВЛЕНИЕ ПРОФИЛЯ
 @app.post("/update_profile")
 def update_profile(
+        background_tasks: BackgroundTasks,
         name: str = Form(...), university: str = Form(""), course: int = Form(1),
         bio: str = Form(""), telegram: str = Form(""), age: str = Form(""),
         privacy: str = Form(''), avatar: UploadFile = File(None), email: str = Form(...),
@@ -375,7 +504,7 @@ def update_profile(
     user.course = course
     user.bio = bio
     user.telegram = telegram
-    user.privacy_settings = privacy
+    user.privacy_settings = schemas.parse_privacy(privacy)
     if age and age.isdigit():
         user.age = int(age)
     else:
@@ -385,10 +514,17 @@ def update_profile(
         ext = avatar.filename.split('.')[-1]
         filename = f"avatar_{user.id}_{uuid.uuid4()}.{ext}"
         with open(f"uploads/{filename}", "wb+") as buffer: shutil.copyfileobj(avatar.file, buffer)
+        if user.avatar_key:
+            for old_name in avatars.derivative_names(user.avatar_key): schedule_file_deletion(db, old_name)
+        elif user.avatar_url:
+            schedule_file_deletion(db, user.avatar_url)
         user.avatar_url = filename
+        user.avatar_key = None
+        background_tasks.add_task(process_avatar, user.id, filename)
 
     db.commit()
-    return {"status": "ok", "avatarUrl": user.avatar_url}
+    # готовые ссылки: после обработки — неизменяемые /avatars/..., до неё — оригинал из /static
+    return {"status": "ok", "avatarUrl": avatar_url_for(user, 256), "avatars": avatar_urls(user)}
 
 
 # 8. ПОЛУЧЕНИЕ ЧУЖОГО ПРОФИЛЯ
@@ -397,12 +533,7 @@ def get_public_profile(user_id: int, db: Session = Depends(get_db)):
     user = db.query(models.User).filter(models.User.id == user_id).first()
     if not user: return {"error": "Пользователь не найден"}
 
-    privacy = {"email": False, "bio": True, "uni": True, "tg": True}
-    if user.privacy_settings:
-        try:
-            privacy = json.loads(user.privacy_settings)
-        except:
-            pass
+    privacy = user.privacy_settings or schemas.PrivacySettings().model_dump()
 
     total_materials = len(user.materials)
     total_likes = sum(m.likes_count for m in user.materials)
@@ -411,7 +542,7 @@ def get_public_profile(user_id: int, db: Session = Depends(get_db)):
 
     return {
         "id": user.id, "name": user.username,
-        "avatarUrl": f"/static/{user.avatar_url}" if user.avatar_url else None,
+        "avatarUrl": avatar_url_for(user, 256), "avatars": avatar_urls(user),
         "university": user.university if privacy.get("uni") else "Скрыто",
         "course": str(user.course) if (user.course and privacy.get("uni")) else "",
         "bio": user.bio if privacy.get("bio") else "Информация скрыта пользователем",
@@ -436,7 +567,8 @@ def download_file(file_id: int, db: Session = Depends(get_db)):
 
 # 10. УПРАВЛЕНИЕ ЛАЙКАМИ
 @app.post("/toggle_like")
-def toggle_like_action(material_id: int = Form(...), email: str = Form(...), db: Session = Depends(get_db)):
+def toggle_like_action(background_tasks: BackgroundTasks, material_id: int = Form(...), email: str = Form(...),
+                       db: Session = Depends(get_db)):
     user = db.query(models.User).filter(models.User.email == email).first()
     material = db.query(models.Material).filter(models.Material.id == material_id).first()
     if not user or not material: return {"status": "error"}
@@ -454,6 +586,7 @@ def toggle_like_action(material_id: int = Form(...), email: str = Form(...), db:
         material.likes_count += 1
         liked_now = True
     db.commit()
+    background_tasks.add_task(refresh_user_recommendations, user.id)
     return {"status": "ok", "likes": material.likes_count, "isLiked": liked_now}
 
 
@@ -477,15 +610,16 @@ def delete_material_action(material_id: int = Form(...), email: str = Form(...),
     if not material or not user or material.author_id != user.id:
         return {"status": "error", "message": "Нет прав"}
 
+    # сами файлы удалит фоновый сборщик после коммита
     for f in material.files:
-        try:
-            if os.path.exists(f"uploads/{f.file_path}"): os.remove(f"uploads/{f.file_path}")
-        except:
-            pass
+        schedule_file_deletion(db, f.file_path)
 
     db.query(models.UserLike).filter(models.UserLike.material_id == material_id).delete()
+    db.query(models.UserFavorite).filter(models.UserFavorite.material_id == material_id).delete()
     db.query(models.UserAI).filter(models.UserAI.material_id == material_id).delete()
+    db.query(models.UserRecommendation).filter(models.UserRecommendation.material_id == material_id).delete()
     db.delete(material)
+    db.add(models.MaterialDeletion(material_id=material_id))
     db.commit()
     return {"status": "ok"}
 
@@ -522,7 +656,7 @@ def edit_material_action(
 
     if files and len(files) > 0 and files[0].filename:
         for old_f in material.files:
-            if os.path.exists(f"uploads/{old_f.file_path}"): os.remove(f"uploads/{old_f.file_path}")
+            schedule_file_deletion(db, old_f.file_path)
         db.query(models.MaterialFile).filter(models.MaterialFile.material_id == material_id).delete()
 
         for file in files:
@@ -541,30 +675,15 @@ def edit_material_action(
             )
             db.add(new_file)
 
+    # отметка ставится перед самым коммитом: копирование файлов может идти дольше запаса курсора /api/sync,
+    # и к тому же замена одних только файлов не меняет строку материала
+    material.updated_at = datetime.utcnow()
     db.commit()
     return {"status": "ok"}
 
 
 # гигачат
 
-def extract_text_from_file(file_path: str) -> str:
-    text = ""
-    try:
-        if file_path.endswith(".pdf"):
-            with open(f"uploads/{file_path}", "rb") as f:
-                reader = PyPDF2.PdfReader(f)
-                for page in reader.pages[:5]: text += page.extract_text() + "\n"
-        elif file_path.endswith(".docx"):
-            doc = docx.Document(f"uploads/{file_path}")
-            for para in doc.paragraphs: text += para.text + "\n"
-        elif file_path.endswith(".txt"):
-            with open(f"uploads/{file_path}", "r", encoding="utf-8") as f:
-                text = f.read()
-    except Exception as e:
-        print(f"Ошибка чтения файла: {e}")
-    return text[:8000]
-
-
 @app.post("/api/ai/analyze")
 def analyze_material_ai(
         material_id: int = Form(...), email: str = Form(...), db: Session = Depends(get_db)
@@ -601,7 +720,8 @@ def analyze_material_ai(
 
 # 14. УПРАВЛЕНИЕ ИЗБРАННЫМ
 @app.post("/toggle_fav")
-def toggle_fav_action(material_id: int = Form(...), email: str = Form(...), db: Session = Depends(get_db)):
+def toggle_fav_action(background_tasks: BackgroundTasks, material_id: int = Form(...), email: str = Form(...),
+                      db: Session = Depends(get_db)):
     user = db.query(models.User).filter(models.User.email == email).first()
     material = db.query(models.Material).filter(models.Material.id == material_id).first()
     if not user or not material: return {"status": "error"}
@@ -619,18 +739,23 @@ def toggle_fav_action(material_id: int = Form(...), email: str = Form(...), db:
         is_fav_now = True
 
     db.commit()
+    background_tasks.add_task(refresh_user_recommendations, user.id)
     return {"status": "ok", "isFav": is_fav_now}
 
 
 # 15. СОХРАНЕНИЕ ИЗБРАННЫХ КАТЕГОРИЙ
 @app.post("/api/update_fav_cats")
-def update_fav_cats(email: str = Form(...), categories: str = Form(...), db: Session = Depends(get_db)):
+def update_fav_cats(background_tasks: BackgroundTasks, email: str = Form(...), categories: str = Form(...),
+                    db: Session = Depends(get_db)):
     user = db.query(models.User).filter(models.User.email == email).first()
     if not user: return {"error": "Пользователь не найден"}
 
-    # Сохраняем пришедший JSON-строку в базу
-    user.fav_categories = categories
+    try:
+        user.fav_categories = schemas.parse_fav_categories(categories)
+    except ValueError:
+        return {"error": "Некорректный список категорий"}
     db.commit()
+    background_tasks.add_task(refresh_user_recommendations, user.id)
     return {"status": "ok"}
 
 
@@ -722,6 +847,7 @@ def edit_task(
     if not user or not task or task.user_id != user.id:
         return {"status": "error", "message": "Задача не найдена"}
 
+    old_deadline = task.deadline
     task.text = text
     task.subject = subject
     task.is_urgent = (is_urgent == "true")
@@ -738,5 +864,479 @@ def edit_task(
     else:
         task.deadline = None
 
+    # дедлайн перенесли — напоминания нужно отправить заново
+    if task.deadline != old_deadline:
+        db.query(models.TaskReminder).filter(models.TaskReminder.task_id == task.id).delete()
+
+    db.commit()
+    return {"status": "ok"}
+
+
+def parse_deadline(date: str, time: str):
+    """Собирает дедлайн из полей формы; пустые/"undefined" значения — без дедлайна. Бросает ValueError."""
+    if not date or date in ("undefined", "null"):
+        return None
+    if time and time not in ("undefined", "null"):
+        return datetime.strptime(f"{date} {time}", "%Y-%m-%d %H:%M")
+    return datetime.strptime(date, "%Y-%m-%d")
+
+
+TASK_BATCH_LIMIT = 200
+
+
+def batch_task_id(op: dict):
+    """task_id операции как int; bool, дробные и прочие значения — None."""
+    value = op.get("task_id")
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.strip().isdigit():
+        return int(value)
+    return None
+
+
+@app.post("/api/task/batch")
+def batch_tasks(email: str = Form(...), operations: str = Form(...), db: Session = Depends(get_db)):
+    """
+    Пачка операций над задачами за один запрос и одну транзакцию.
+    operations — JSON-список вида {"op": "add"|"edit"|"toggle"|"delete", "task_id", "text", "subject",
+    "date", "time", "is_urgent"}; в ответе результат по каждой операции в том же порядке.
+    """
+    user = db.query(models.User).filter(models.User.email == email).first()
+    if not user: return {"status": "error", "message": "Пользователь не найден"}
+
+    try:
+        ops = json.loads(operations)
+    except ValueError:
+        return {"status": "error", "message": "Некорректный список операций"}
+    if not isinstance(ops, list) or len(ops) > TASK_BATCH_LIMIT:
+        return {"status": "error", "message": "Некорректный список операций"}
+
+    # права проверяем одним запросом: берём только задачи этого пользователя
+    task_ids = set()
+    for op in ops:
+        if isinstance(op, dict) and op.get("op") in ("edit", "toggle", "delete") and batch_task_id(op) is not None:
+            task_ids.add(batch_task_id(op))
+    owned = {}
+    if task_ids:
+        owned = {t.id: t for t in db.query(models.Task).filter(models.Task.id.in_(task_ids),
+                                                               models.Task.user_id == user.id).all()}
+
+    results, new_tasks, to_delete, deadline_changed = [], [], set(), set()
+    for op in ops:
+        kind = op.get("op") if isinstance(op, dict) else None
+        if kind not in ("add", "edit", "toggle", "delete"):
+            results.append({"status": "error", "message": "Неизвестная операция"})
+            continue
+
+        if kind != "add":
+            task = owned.get(batch_task_id(op))
+            if not task or task.id in to_delete:
+                results.append({"status": "error", "message": "Задача не найдена"})
+                continue
+
+        if kind in ("add", "edit"):
+            if any(op.get(field) is not None and not isinstance(op.get(field), str)
+                   for field in ("text", "subject", "date", "time")):
+                results.append({"status": "error", "message": "Некорректные поля задачи"})
+                continue
+            if not op.get("text"):
+                results.append({"status": "error", "message": "Пустой текст задачи"})
+                continue
+            try:
+                deadline = parse_deadline(op.get("date") or "", op.get("time") or "")
+            except ValueError:
+                results.append({"status": "error", "message": "Неверная дата"})
+                continue
+            is_urgent = op.get("is_urgent") in (True, "true")
+
+        if kind == "add":
+            task = models.Task(text=op["text"], subject=op.get("subject") or "", deadline=deadline,
+                               is_urgent=is_urgent, user_id=user.id)
+            db.add(task)
+            new_tasks.append((len(results), task))
+            results.append({"status": "ok"})
+        elif kind == "edit":
+            if task.deadline != deadline: deadline_changed.add(task.id)
+            task.text = op["text"]
+            task.subject = op.get("subject") or ""
+            task.deadline = deadline
+            task.is_urgent = is_urgent
+            results.append({"status": "ok", "id": task.id})
+        elif kind == "toggle":
+            task.is_done = not task.is_done
+            results.append({"status": "ok", "id": task.id, "is_done": task.is_done})
+        else:
+            to_delete.add(task.id)
+            results.append({"status": "ok", "id": task.id})
+
+    if deadline_changed:
+        db.query(models.TaskReminder).filter(models.TaskReminder.task_id.in_(deadline_changed)).delete(
+            synchronize_session=False)
+    if to_delete:
+        for task_id in to_delete:
+            db.expunge(owned[task_id])
+        db.query(models.Task).filter(models.Task.id.in_(to_delete)).delete(synchronize_session=False)
+
+    db.flush()
+    for idx, task in new_tasks:
+        results[idx]["id"] = task.id
     db.commit()
-    return {"status": "ok"}
\ No newline at end of file
+    return {"status": "ok", "results": results}
+
+
+# инкрементальная синхронизация ленты
+# запас назад по времени: строки из транзакций, закоммиченных чуть позже выдачи курсора
+SYNC_OVERLAP_SECONDS = 5
+# сколько храним журнал удалений; клиенту с более старым курсором нужна полная перезагрузка
+SYNC_DELETION_RETENTION_DAYS = int(os.getenv("SYNC_DELETION_RETENTION_DAYS", 30))
+
+
+def make_sync_cursor() -> str:
+    return (datetime.utcnow() - timedelta(seconds=SYNC_OVERLAP_SECONDS)).isoformat()
+
+
+@app.get("/api/sync")
+def sync_materials(since: str, email: str, db: Session = Depends(get_db)):
+    """Материалы, созданные/изменённые (в т.ч. счётчики) и удалённые после курсора since."""
+    user = db.query(models.User).filter(models.User.email == email).first()
+    if not user: return {"status": "error", "message": "Пользователь не найден"}
+    try:
+        since_dt = datetime.fromisoformat(since)
+    except ValueError:
+        return {"status": "error", "message": "Некорректный курсор"}
+    if since_dt.tzinfo is not None:
+        # в базе время хранится без зоны, в UTC
+        since_dt = since_dt.astimezone(timezone.utc).replace(tzinfo=None)
+    if since_dt < datetime.utcnow() - timedelta(days=SYNC_DELETION_RETENTION_DAYS):
+        # журнал удалений за этот период уже почищен — инкрементально догнать нельзя
+        return {"status": "reset"}
+
+    cursor = make_sync_cursor()
+    changed = (db.query(models.Material)
+               .options(joinedload(models.Material.author), joinedload(models.Material.files))
+               .filter(models.Material.updated_at > since_dt)
+               .all())
+    deleted = [row[0] for row in db.query(models.MaterialDeletion.material_id)
+               .filter(models.MaterialDeletion.deleted_at > since_dt).all()]
+
+    ai_map, my_likes_ids, my_favs_ids = user_material_marks(db, user.id, [m.id for m in changed])
+    return {
+        "status": "ok", "cursor": cursor,
+        "materials": [serialize_material(m, ai_map, my_likes_ids, my_favs_ids) for m in changed],
+        "deleted": deleted
+    }
+
+
+@periodic(24 * 3600)
+def prune_material_deletions():
+    db = SessionLocal()
+    try:
+        cutoff = datetime.utcnow() - timedelta(days=SYNC_DELETION_RETENTION_DAYS)
+        db.query(models.MaterialDeletion).filter(models.MaterialDeletion.deleted_at < cutoff).delete()
+        db.commit()
+    finally:
+        db.close()
+
+
+# число подписчиков категории (по GIN-индексу на users.fav_categories)
+@app.get("/api/category/subscribers")
+def get_category_subscribers(category: str, db: Session = Depends(get_db)):
+    count = db.query(models.User).filter(models.User.fav_categories.contains([category])).count()
+    return {"status": "ok", "category": category, "subscribers": count}
+
+
+# рекомендации "для вас"
+RECOMMENDATIONS_REFRESH_MINUTES = int(os.getenv("RECOMMENDATIONS_REFRESH_MINUTES", 60))
+
+
+@periodic(RECOMMENDATIONS_REFRESH_MINUTES * 60)
+def refresh_all_recommendations():
+    db = SessionLocal()
+    try:
+        count = recommendations.refresh_all(db)
+        print(f"Рекомендации пересчитаны для {count} пользователей")
+    finally:
+        db.close()
+
+
+def refresh_user_recommendations(user_id: int):
+    db = SessionLocal()
+    try:
+        recommendations.refresh_user(db, user_id)
+    except Exception as e:
+        print(f"Ошибка пересчёта рекомендаций: {e}")
+    finally:
+        db.close()
+
+
+@app.get("/api/recommendations")
+def get_recommendations(email: str, limit: int = 20, db: Session = Depends(get_db)):
+    user = db.query(models.User).filter(models.User.email == email).first()
+    if not user: return {"error": "Пользователь не найден"}
+
+    limit = max(1, min(limit, recommendations.TOP_K))
+    rows = (db.query(models.UserRecommendation, models.Material)
+            .join(models.Material, models.Material.id == models.UserRecommendation.material_id)
+            .options(joinedload(models.Material.author))
+            .filter(models.UserRecommendation.user_id == user.id,
+                    # снимок для пересчёта может быть старым — материал могли скрыть уже после него
+                    models.Material.is_private == False)
+            .order_by(models.UserRecommendation.score.desc())
+            .limit(limit).all())
+
+    items = [dict(material_brief(m), score=round(rec.score, 4)) for rec, m in rows]
+    return {"status": "ok", "items": items}
+
+
+def material_brief(m: models.Material) -> dict:
+    return {
+        "id": m.id, "title": m.title, "author": m.author.username if m.author else "Неизвестный",
+        "authorId": m.author_id, "category": m.category, "course": m.course, "type": m.material_type,
+        "date": m.created_at.strftime("%d.%m.%Y") if m.created_at else None,
+        "likes": m.likes_count, "downloads": m.downloads_count, "views": m.views_count
+    }
+
+
+# популярное сейчас
+TRENDING_REFRESH_MINUTES = int(os.getenv("TRENDING_REFRESH_MINUTES", 10))
+TRENDING_HALF_LIFE_HOURS = float(os.getenv("TRENDING_HALF_LIFE_HOURS", 72))
+TRENDING_WEIGHTS = {"likes": 3.0, "downloads": 2.0, "views": 0.5}
+# оценки ниже порога обнуляются, а строку переписываем, только если оценка сдвинулась больше чем на 1%:
+# иначе каждый запуск обновлял бы все строки и раздувал таблицу и её индексы
+TRENDING_MIN_SCORE = 1e-3
+TRENDING_RELATIVE_STEP = 0.01
+
+
+@periodic(TRENDING_REFRESH_MINUTES * 60)
+def refresh_trending():
+    # один UPDATE на стороне БД: (взвешенная активность) * 2^(-возраст / период полураспада)
+    # показатель exp() ограничен снизу: иначе у очень старых материалов float8 уходит в underflow и падает весь UPDATE
+    with engine.begin() as conn:
+        conn.execute(text("""
+            WITH fresh AS (
+                SELECT id, score * (score >= :min_score)::int AS score FROM (
+                    SELECT id,
+                        (:w_likes * COALESCE(likes_count, 0)
+                         + :w_downloads * COALESCE(downloads_count, 0)
+                         + :w_views * COALESCE(views_count, 0))
+                        * exp(GREATEST(-700, -ln(2)
+                              * GREATEST(EXTRACT(EPOCH FROM (:now - COALESCE(created_at, :now))), 0)
+                              / :half_life_seconds)) AS score
+                    FROM materials
+                ) raw
+            )
+            UPDATE materials m SET trending_score = f.score
+            FROM fresh f
+            WHERE m.id = f.id
+              AND (m.trending_score IS NULL
+                   OR abs(m.trending_score - f.score) > :step * GREATEST(m.trending_score, :min_score))
+        """), {
+            "w_likes": TRENDING_WEIGHTS["likes"], "w_downloads": TRENDING_WEIGHTS["downloads"],
+            "w_views": TRENDING_WEIGHTS["views"], "now": datetime.utcnow(),
+            "half_life_seconds": TRENDING_HALF_LIFE_HOURS * 3600,
+            "min_score": TRENDING_MIN_SCORE, "step": TRENDING_RELATIVE_STEP
+        })
+
+
+@app.get("/api/materials/trending")
+def get_trending_materials(category: str = None, course: int = None, limit: int = 20,
+                           db: Session = Depends(get_db)):
+    query = (db.query(models.Material)
+             .options(joinedload(models.Material.author))
+             .filter(models.Material.is_private == False))
+    if category:
+        query = query.filter(models.Material.category == category)
+    if course:
+        query = query.filter(models.Material.course == course)
+
+    materials = query.order_by(models.Material.trending_score.desc()).limit(max(1, min(limit, 100))).all()
+    items = [dict(material_brief(m), score=round(m.trending_score or 0, 4)) for m in materials]
+    return {"status": "ok", "items": items}
+
+
+# напоминания о дедлайнах
+# окна в часах до дедлайна: по умолчанию напоминаем за сутки и за час
+REMINDER_WINDOWS_HOURS = sorted(int(h) for h in os.getenv("REMINDER_WINDOWS_HOURS", "24,1").split(",") if h.strip())
+REMINDER_CHECK_MINUTES = int(os.getenv("REMINDER_CHECK_MINUTES", 5))
+REMINDER_BATCH_SIZE = int(os.getenv("REMINDER_BATCH_SIZE", 200))
+
+
+def claim_due_reminders(now: datetime, window_hours: int) -> dict:
+    """Забирает пачку задач с дедлайном в окне и помечает их отправленными. Возвращает {email: (имя, задачи)}."""
+    db = SessionLocal()
+    try:
+        # напоминание за это или более узкое окно уже было — повторно не шлём
+        already_sent = exists().where(models.TaskReminder.task_id == models.Task.id,
+                                      models.TaskReminder.window_hours <= window_hours)
+        rows = (db.query(models.Task, models.User.email, models.User.username)
+                .join(models.User, models.User.id == models.Task.user_id)
+                .filter(models.Task.is_done == False,
+                        models.Task.deadline > now,
+                        models.Task.deadline <= now + timedelta(hours=window_hours),
+                        models.User.is_active == True,
+                        ~already_sent)
+                .order_by(models.Task.deadline)
+                .limit(REMINDER_BATCH_SIZE).all())
+        if not rows:
+            return {}
+
+        # уникальный индекс (task_id, window_hours) защищает от двойной отправки при параллельных запусках
+        claimed = db.execute(
+            pg_insert(models.TaskReminder)
+            .values([{"task_id": t.id, "window_hours": window_hours, "sent_at": datetime.utcnow()} for t, _, _ in rows])
+            .on_conflict_do_nothing(index_elements=["task_id", "window_hours"])
+            .returning(models.TaskReminder.task_id)
+        ).scalars().all()
+        db.commit()
+
+        claimed = set(claimed)
+        batch = {}
+        for t, email, name in rows:
+            if t.id not in claimed: continue
+            batch.setdefault(email, (name, []))[1].append({
+                "id": t.id, "text": t.text, "subject": t.subject,
+                "deadline": t.deadline.strftime("%d.%m.%Y %H:%M")
+            })
+        return batch
+    finally:
+        db.close()
+
+
+def release_reminders(task_ids: list, window_hours: int):
+    db = SessionLocal()
+    try:
+        db.query(models.TaskReminder).filter(models.TaskReminder.task_id.in_(task_ids),
+                                             models.TaskReminder.window_hours == window_hours).delete()
+        db.commit()
+    finally:
+        db.close()
+
+
+@periodic(REMINDER_CHECK_MINUTES * 60)
+async def send_deadline_reminders():
+    # дедлайны вводятся в локальном времени сервера, поэтому сравниваем с datetime.now()
+    now = datetime.now()
+    for window_hours in REMINDER_WINDOWS_HOURS:
+        while True:
+            batch = await run_in_threadpool(claim_due_reminders, now, window_hours)
+            if not batch: break
+            failed = []
+            for email, (name, tasks) in batch.items():
+                try:
+                    await send_deadline_reminder_email(email, name, tasks)
+                except Exception as e:
+                    print(f"Ошибка отправки напоминания: {e}")
+                    failed.extend(t["id"] for t in tasks)
+            if failed:
+                # письма не ушли — снимаем отметку и пробуем при следующем запуске
+                await run_in_threadpool(release_reminders, failed, window_hours)
+                return
+
+
+# удаление файлов и сборка мусора в uploads/
+REAPER_INTERVAL_SECONDS = int(os.getenv("REAPER_INTERVAL_SECONDS", 60))
+REAPER_BATCH_SIZE = int(os.getenv("REAPER_BATCH_SIZE", 500))
+SWEEP_INTERVAL_HOURS = int(os.getenv("SWEEP_INTERVAL_HOURS", 24))
+# файлы моложе этого возраста не трогаем: их может прямо сейчас записывать загрузка
+SWEEP_GRACE_HOURS = int(os.getenv("SWEEP_GRACE_HOURS", 6))
+# первый проход не сразу после старта, чтобы успеть заметить, что приложение смотрит не в ту базу
+SWEEP_FIRST_DELAY_MINUTES = int(os.getenv("SWEEP_FIRST_DELAY_MINUTES", 60))
+# если "сиротами" оказалась такая доля файлов, скорее всего база пустая или чужая — ничего не удаляем
+SWEEP_MAX_ORPHAN_FRACTION = float(os.getenv("SWEEP_MAX_ORPHAN_FRACTION", 0.5))
+
+
+def referenced_files(db: Session, paths=None) -> set:
+    """Имена файлов в uploads/, на которые ещё ссылается база (все или только из paths)."""
+    files = db.query(models.MaterialFile.file_path)
+    avatar_files = db.query(models.User.avatar_url).filter(models.User.avatar_url != None)
+    avatar_keys = db.query(models.User.avatar_key).filter(models.User.avatar_key != None)
+    if paths is not None:
+        files = files.filter(models.MaterialFile.file_path.in_(paths))
+        avatar_files = avatar_files.filter(models.User.avatar_url.in_(paths))
+        avatar_keys = avatar_keys.filter(models.User.avatar_key.in_({avatars.key_from_name(p) for p in paths} - {None}))
+
+    used = {row[0] for row in files.all()} | {row[0] for row in avatar_files.all()}
+    for row in avatar_keys.all():
+        used.update(avatars.derivative_names(row[0]))
+    return used
+
+
+def remove_upload(file_path: str) -> int:
+    """Удаляет файл из uploads/ и возвращает освобождённые байты."""
+    full_path = os.path.join("uploads", os.path.basename(file_path))
+    try:
+        size = os.path.getsize(full_path)
+        os.remove(full_path)
+        return size
+    except FileNotFoundError:
+        return 0
+    except OSError as e:
+        print(f"Ошибка удаления файла {file_path}: {e}")
+        return 0
+
+
+@periodic(REAPER_INTERVAL_SECONDS)
+def reap_deleted_files():
+    db = SessionLocal()
+    removed = reclaimed = 0
+    try:
+        while True:
+            tombstones = (db.query(models.FileTombstone).order_by(models.FileTombstone.id)
+                          .limit(REAPER_BATCH_SIZE).all())
+            if not tombstones: break
+
+            # файл мог снова понадобиться (импорт кладёт одинаковое содержимое под одним именем);
+            # учитываются только закоммиченные ссылки — незакоммиченный импорт сам докопирует файл после коммита
+            paths = {t.file_path for t in tombstones if t.file_path}
+            still_used = referenced_files(db, paths)
+            for path in paths - still_used:
+                size = remove_upload(path)
+                removed += 1 if size else 0
+                reclaimed += size
+
+            db.query(models.FileTombstone).filter(
+                models.FileTombstone.id.in_([t.id for t in tombstones])).delete(synchronize_session=False)
+            db.commit()
+    finally:
+        db.close()
+    if removed:
+        print(f"Удалено файлов: {removed}, освобождено {reclaimed / 1024 / 1024:.2f} MB")
+
+
+@periodic(SWEEP_INTERVAL_HOURS * 3600, first_delay_seconds=SWEEP_FIRST_DELAY_MINUTES * 60)
+def sweep_orphan_files():
+    """Сверяет uploads/ с базой и удаляет файлы, на которые никто не ссылается."""
+    db = SessionLocal()
+    try:
+        used = referenced_files(db)
+    finally:
+        db.close()
+
+    cutoff = datetime.now().timestamp() - SWEEP_GRACE_HOURS * 3600
+    total = 0
+    orphans = []
+    with os.scandir("uploads") as entries:
+        for entry in entries:
+            if not entry.is_file(): continue
+            total += 1
+            if entry.name in used or entry.stat().st_mtime > cutoff: continue
+            orphans.append(entry.name)
+
+    if not orphans:
+        return 0
+    if not used:
+        print(f"ВНИМАНИЕ: сборщик мусора пропущен — база не ссылается ни на один файл, "
+              f"а в uploads/ {total} файлов. Проверьте подключение к базе (DB_NAME).")
+        return 0
+    if len(orphans) > SWEEP_MAX_ORPHAN_FRACTION * total:
+        print(f"ВНИМАНИЕ: сборщик мусора пропущен — сиротами выглядят {len(orphans)} из {total} файлов "
+              f"(порог {SWEEP_MAX_ORPHAN_FRACTION:.0%}). Проверьте базу или поднимите SWEEP_MAX_ORPHAN_FRACTION.")
+        return 0
+
+    removed = reclaimed = 0
+    for name in orphans:
+        size = remove_upload(name)
+        removed += 1 if size else 0
+        reclaimed += size
+    print(f"Сборщик мусора: удалено {removed} файлов-сирот, освобождено {reclaimed / 1024 / 1024:.2f} MB")
+    return reclaimed
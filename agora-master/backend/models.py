@@ -1,6 +1,10 @@
-from sqlalchemy import Column, Integer, String, Text, ForeignKey, Boolean, DateTime
+import json
+from sqlalchemy import Column, Integer, String, Text, ForeignKey, Boolean, DateTime, Float, Index, UniqueConstraint
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import relationship
 from backend.database import Base
+from backend import schemas
 from datetime import datetime
 
 
@@ -17,14 +21,22 @@ class User(Base):
     bio = Column(String, nullable=True)
     telegram = Column(String, nullable=True)
     avatar_url = Column(String, nullable=True)
+    # ключ готовых уменьшенных копий аватарки (см. backend/avatars.py); пока их нет — отдаём avatar_url
+    avatar_key = Column(String, nullable=True)
     age = Column(Integer, nullable=True)
-    privacy_settings = Column(String, default='{"email": false, "bio": true, "uni": true, "tg": true}')
-    fav_categories = Column(String, default='[]')
+    # JSONB, значения проверяются через backend/schemas.py перед записью
+    privacy_settings = Column(JSONB, default=lambda: schemas.PrivacySettings().model_dump())
+    fav_categories = Column(JSONB, default=list)
     created_at = Column(DateTime, default=datetime.utcnow)
 
     materials = relationship("Material", back_populates="author")
     tasks = relationship("Task", back_populates="user")
 
+    __table_args__ = (
+        # "кто подписан на категорию X": fav_categories @> '["X"]'
+        Index("ix_users_fav_categories", fav_categories, postgresql_using="gin"),
+    )
+
 
 class Material(Base):
     __tablename__ = "materials"
@@ -40,6 +52,10 @@ class Material(Base):
     views_count = Column(Integer, default=0)
     ai_summary = Column(Text, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
+    # популярность с экспоненциальным затуханием, пересчитывается по расписанию (см. refresh_trending в main.py)
+    trending_score = Column(Float, default=0)
+    # меняется при любом UPDATE строки (правка, лайки, просмотры, скачивания) — курсор для /api/sync
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
 
     author_id = Column(Integer, ForeignKey("users.id"))
     author = relationship("User", back_populates="materials")
@@ -47,6 +63,14 @@ class Material(Base):
     # ВОТ ЭТА СТРОКА ВАЖНА (Связь с файлами)
     files = relationship("MaterialFile", back_populates="material", cascade="all, delete-orphan")
 
+    __table_args__ = (
+        Index("ix_materials_trending", trending_score.desc(), postgresql_where=(is_private == False)),
+        Index("ix_materials_category_trending", "category", trending_score.desc(),
+              postgresql_where=(is_private == False)),
+        Index("ix_materials_course_trending", "course", trending_score.desc(),
+              postgresql_where=(is_private == False)),
+    )
+
 
 class MaterialFile(Base):
     __tablename__ = "material_files"
@@ -55,6 +79,8 @@ class MaterialFile(Base):
     filename = Column(String)
     file_path = Column(String)
     file_size = Column(String)
+    # sha256 содержимого; заполняется массовым импортом и используется для продолжения после сбоя
+    sha256 = Column(String, nullable=True, index=True)
     material = relationship("Material", back_populates="files")
 
 
@@ -85,6 +111,11 @@ class Task(Base):
     user_id = Column(Integer, ForeignKey("users.id"))
     user = relationship("User", back_populates="tasks")
 
+    __table_args__ = (
+        # планировщик напоминаний смотрит только на невыполненные задачи с дедлайном
+        Index("ix_tasks_deadline_pending", "deadline", postgresql_where=(is_done == False)),
+    )
+
 
 class Category(Base):
     __tablename__ = "categories"
@@ -97,4 +128,101 @@ class UserFavorite(Base):
     __tablename__ = "user_favorites"
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"))
-    material_id = Column(Integer, ForeignKey("materials.id"))
\ No newline at end of file
+    material_id = Column(Integer, ForeignKey("materials.id"))
+
+
+class UserRecommendation(Base):
+    # Предрассчитанный топ-K рекомендаций "для вас" (заполняется backend/recommendations.py)
+    __tablename__ = "user_recommendations"
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"))
+    material_id = Column(Integer, ForeignKey("materials.id"))
+    score = Column(Float)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_user_recommendations_user_score", "user_id", score.desc()),
+        Index("uq_user_recommendations_user_material", "user_id", "material_id", unique=True),
+    )
+
+
+class TaskReminder(Base):
+    # Отправленные напоминания о дедлайне: одно на задачу и окно (в часах до дедлайна)
+    __tablename__ = "task_reminders"
+    id = Column(Integer, primary_key=True, index=True)
+    task_id = Column(Integer, ForeignKey("tasks.id", ondelete="CASCADE"))
+    window_hours = Column(Integer)
+    sent_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        UniqueConstraint("task_id", "window_hours", name="uq_task_reminders_task_window"),
+    )
+
+
+class FileTombstone(Base):
+    # Файл из uploads/, который нужно удалить; запись создаётся в той же транзакции, что и удаление строк
+    __tablename__ = "file_tombstones"
+    id = Column(Integer, primary_key=True, index=True)
+    file_path = Column(String)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class MaterialDeletion(Base):
+    # Журнал удалённых материалов для инкрементальной синхронизации (/api/sync)
+    __tablename__ = "material_deletions"
+    id = Column(Integer, primary_key=True, index=True)
+    material_id = Column(Integer)
+    deleted_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+
+# create_all не добавляет новые колонки в уже существующие таблицы, поэтому докатываем их здесь
+SCHEMA_UPGRADES = [
+    "ALTER TABLE materials ADD COLUMN IF NOT EXISTS trending_score DOUBLE PRECISION DEFAULT 0",
+    "ALTER TABLE material_files ADD COLUMN IF NOT EXISTS sha256 VARCHAR",
+    "ALTER TABLE users ADD COLUMN IF NOT EXISTS avatar_key VARCHAR",
+    # дубли от параллельных пересчётов мешают создать уникальный индекс (user_id, material_id)
+    "DELETE FROM user_recommendations a USING user_recommendations b "
+    "WHERE a.user_id = b.user_id AND a.material_id = b.material_id AND a.id > b.id",
+    "ALTER TABLE materials ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP DEFAULT (now() AT TIME ZONE 'utc')",
+]
+
+
+def migrate_user_json_columns(conn):
+    """Переводит users.privacy_settings и users.fav_categories из строк с JSON в JSONB."""
+    types = dict(conn.execute(text(
+        "SELECT column_name, data_type FROM information_schema.columns "
+        "WHERE table_name = 'users' AND column_name IN ('privacy_settings', 'fav_categories')"
+    )).all())
+    legacy = [column for column, data_type in types.items() if data_type != "jsonb"]
+    if not legacy:
+        return
+
+    def parse_categories(raw):
+        try:
+            return schemas.parse_fav_categories(raw)
+        except ValueError:
+            return []
+
+    parsers = {"privacy_settings": schemas.parse_privacy, "fav_categories": parse_categories}
+    rows = conn.execute(text(f"SELECT id, {', '.join(legacy)} FROM users")).mappings().all()
+    for column in legacy:
+        conn.execute(text(f"ALTER TABLE users ALTER COLUMN {column} DROP DEFAULT"))
+        conn.execute(text(f"ALTER TABLE users ALTER COLUMN {column} TYPE JSONB USING NULL"))
+    if rows:
+        assignments = ", ".join(f"{column} = CAST(:{column} AS JSONB)" for column in legacy)
+        conn.execute(text(f"UPDATE users SET {assignments} WHERE id = :id"), [
+            {"id": row["id"], **{column: json.dumps(parsers[column](row[column])) for column in legacy}}
+            for row in rows
+        ])
+
+
+def init_schema(engine):
+    Base.metadata.create_all(bind=engine)
+    # новые колонки и индексы для таблиц, созданных до их появления в этом файле
+    with engine.begin() as conn:
+        for ddl in SCHEMA_UPGRADES:
+            conn.execute(text(ddl))
+        migrate_user_json_columns(conn)
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(bind=conn, checkfirst=True)
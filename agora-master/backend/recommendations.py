@@ -0,0 +1,197 @@
+from datetime import datetime
+
+import numpy as np
+from scipy import sparse
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from backend import models
+
+# сколько рекомендаций храним на пользователя
+TOP_K = 50
+
+# вес взаимодействий: избранное — более сильный сигнал, чем лайк
+LIKE_WEIGHT = 1.0
+FAV_WEIGHT = 2.0
+
+# смешивание: похожесть по лайкам/избранному + любимые категории + немного популярности
+CF_WEIGHT = 0.7
+CATEGORY_WEIGHT = 0.3
+POPULARITY_WEIGHT = 0.05
+
+# ограничение на размер плотной матрицы оценок (пользователи x материалы) за один проход
+MAX_CHUNK_CELLS = 5_000_000
+
+
+class SimilaritySnapshot:
+    """Item-item матрица сходства и признаки материалов на момент полного пересчёта."""
+
+    def __init__(self, material_ids, categories, authors, private, popularity, similarity):
+        self.material_ids = material_ids  # np.array id материалов, индекс = колонка
+        self.col_by_id = {int(mid): i for i, mid in enumerate(material_ids)}
+        self.categories = categories  # np.array категорий (object)
+        self.authors = authors  # np.array author_id
+        self.private = private  # np.array bool
+        self.popularity = popularity  # np.array, нормированный log(1 + лайки) в [0, 1]
+        self.similarity = similarity  # scipy.sparse.csr_matrix (items x items)
+
+
+_snapshot = None
+
+
+def _parse_categories(raw) -> list:
+    # users.fav_categories — JSONB-список, проверенный при записи
+    return [c for c in raw if isinstance(c, str)] if isinstance(raw, list) else []
+
+
+def _load_interactions(db: Session, col_by_id: dict, user_ids=None):
+    """Возвращает (user_ids, rows, cols, weights) по лайкам и избранному."""
+    likes = db.query(models.UserLike.user_id, models.UserLike.material_id)
+    favs = db.query(models.UserFavorite.user_id, models.UserFavorite.material_id)
+    if user_ids is not None:
+        likes = likes.filter(models.UserLike.user_id.in_(user_ids))
+        favs = favs.filter(models.UserFavorite.user_id.in_(user_ids))
+
+    pairs = [(u, m, LIKE_WEIGHT) for u, m in likes.all()] + [(u, m, FAV_WEIGHT) for u, m in favs.all()]
+    pairs = [p for p in pairs if p[0] is not None and p[1] in col_by_id]
+    if not pairs:
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int64), np.array([], dtype=np.int64), np.array([])
+
+    users = np.array([p[0] for p in pairs], dtype=np.int64)
+    cols = np.array([col_by_id[p[1]] for p in pairs], dtype=np.int64)
+    weights = np.array([p[2] for p in pairs], dtype=np.float64)
+    uniq_users, rows = np.unique(users, return_inverse=True)
+    return uniq_users, rows, cols, weights
+
+
+def build_snapshot(db: Session) -> SimilaritySnapshot:
+    materials = db.query(models.Material.id, models.Material.category, models.Material.author_id,
+                         models.Material.is_private, models.Material.likes_count).order_by(models.Material.id).all()
+
+    material_ids = np.array([m[0] for m in materials], dtype=np.int64)
+    categories = np.array([m[1] or "" for m in materials], dtype=object)
+    authors = np.array([m[2] if m[2] is not None else -1 for m in materials], dtype=np.int64)
+    private = np.array([bool(m[3]) for m in materials], dtype=bool)
+    likes = np.log1p(np.maximum(np.array([m[4] or 0 for m in materials], dtype=np.float64), 0))
+    popularity = likes / likes.max() if likes.size and likes.max() > 0 else likes
+
+    col_by_id = {int(mid): i for i, mid in enumerate(material_ids)}
+    _, rows, cols, weights = _load_interactions(db, col_by_id)
+    n_items = len(material_ids)
+    n_users = int(rows.max()) + 1 if rows.size else 0
+
+    # бинарная матрица "пользователь x материал": совместная встречаемость считается по факту взаимодействия
+    interactions = sparse.csr_matrix((np.ones_like(weights), (rows, cols)), shape=(n_users, n_items))
+    interactions.data[:] = 1.0
+
+    # косинусное сходство: C = XᵀX, S_ij = C_ij / sqrt(C_ii * C_jj)
+    cooc = (interactions.T @ interactions).tocsr()
+    norms = np.sqrt(cooc.diagonal())
+    inv = np.divide(1.0, norms, out=np.zeros_like(norms), where=norms > 0)
+    similarity = sparse.diags(inv) @ cooc @ sparse.diags(inv)
+    similarity = similarity.tolil()
+    similarity.setdiag(0)
+    similarity = similarity.tocsr()
+    similarity.eliminate_zeros()
+
+    return SimilaritySnapshot(material_ids, categories, authors, private, popularity, similarity)
+
+
+def _score_users(snapshot: SimilaritySnapshot, user_ids, fav_categories, rows, cols, weights):
+    """Возвращает {user_id: [(material_id, score), ...]} для пачки пользователей."""
+    n_users, n_items = len(user_ids), len(snapshot.material_ids)
+    if n_users == 0 or n_items == 0:
+        return {}
+
+    user_vectors = sparse.csr_matrix((weights, (rows, cols)), shape=(n_users, n_items))
+    cf = (user_vectors @ snapshot.similarity).toarray()
+    cf_max = cf.max(axis=1, keepdims=True)
+    cf = np.divide(cf, cf_max, out=np.zeros_like(cf), where=cf_max > 0)
+
+    cat_match = np.zeros((n_users, n_items))
+    for i, uid in enumerate(user_ids):
+        favs = fav_categories.get(int(uid))
+        if favs:
+            cat_match[i] = np.isin(snapshot.categories, favs)
+
+    base = CF_WEIGHT * cf + CATEGORY_WEIGHT * cat_match
+    scores = base + POPULARITY_WEIGHT * snapshot.popularity * (base > 0)
+
+    # не рекомендуем уже лайкнутое/избранное, чужие приватные и собственные материалы
+    scores[user_vectors.nonzero()] = 0
+    scores[:, snapshot.private] = 0
+    scores[np.asarray(user_ids)[:, None] == snapshot.authors[None, :]] = 0
+
+    k = min(TOP_K, n_items)
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    result = {}
+    for i, uid in enumerate(user_ids):
+        cols_i = top[i][np.argsort(-scores[i, top[i]])]
+        result[int(uid)] = [(int(snapshot.material_ids[c]), float(scores[i, c])) for c in cols_i if scores[i, c] > 0]
+    return result
+
+
+def _store(db: Session, recommendations: dict, lock_users: bool = False):
+    if not recommendations:
+        return
+    now = datetime.utcnow()
+    if lock_users:
+        # параллельные пересчёты одного пользователя (два быстрых лайка) выполняем по очереди,
+        # иначе второй DELETE не видит строк первого и в топе остаются оба набора
+        for uid in sorted(recommendations):
+            db.execute(text("SELECT pg_advisory_xact_lock(:uid)"), {"uid": uid})
+    db.query(models.UserRecommendation).filter(
+        models.UserRecommendation.user_id.in_(list(recommendations))).delete(synchronize_session=False)
+
+    # снимок мог устареть: материал удалили после пересчёта матрицы — такие id пропускаем
+    candidate_ids = {mid for items in recommendations.values() for mid, _ in items}
+    existing = {row[0] for row in db.query(models.Material.id).filter(models.Material.id.in_(candidate_ids)).all()} \
+        if candidate_ids else set()
+    rows = [{"user_id": uid, "material_id": mid, "score": score, "updated_at": now}
+            for uid, items in recommendations.items() for mid, score in items if mid in existing]
+    if rows:
+        # уникальный (user_id, material_id) страхует от гонки с полным пересчётом, который блокировки не берёт
+        stmt = pg_insert(models.UserRecommendation)
+        db.execute(stmt.on_conflict_do_update(
+            index_elements=["user_id", "material_id"],
+            set_={"score": stmt.excluded.score, "updated_at": stmt.excluded.updated_at}
+        ), rows)
+
+
+def refresh_all(db: Session) -> int:
+    """Полный пересчёт: новая матрица сходства и топ-K для всех активных пользователей."""
+    global _snapshot
+    snapshot = build_snapshot(db)
+    _snapshot = snapshot
+
+    users = db.query(models.User.id, models.User.fav_categories).filter(models.User.is_active == True).all()
+    fav_categories = {u[0]: _parse_categories(u[1]) for u in users}
+    all_ids = np.array(sorted(fav_categories), dtype=np.int64)
+
+    chunk_size = max(1, min(1000, MAX_CHUNK_CELLS // max(len(snapshot.material_ids), 1)))
+    for start in range(0, len(all_ids), chunk_size):
+        chunk = all_ids[start:start + chunk_size]
+        interacted, rows, cols, weights = _load_interactions(db, snapshot.col_by_id, user_ids=chunk.tolist())
+        # строки матрицы должны соответствовать порядку chunk
+        rows = np.searchsorted(chunk, interacted[rows]) if rows.size else rows
+        _store(db, _score_users(snapshot, chunk, fav_categories, rows, cols, weights))
+        db.commit()
+    return len(all_ids)
+
+
+def refresh_user(db: Session, user_id: int):
+    """Инкрементальный пересчёт одного пользователя по текущей матрице сходства."""
+    global _snapshot
+    if _snapshot is None:
+        _snapshot = build_snapshot(db)
+    snapshot = _snapshot
+
+    user = db.query(models.User.id, models.User.fav_categories).filter(models.User.id == user_id).first()
+    if not user:
+        return
+    _, rows, cols, weights = _load_interactions(db, snapshot.col_by_id, user_ids=[user_id])
+    chunk = np.array([user_id], dtype=np.int64)
+    _store(db, _score_users(snapshot, chunk, {user_id: _parse_categories(user[1])}, rows, cols, weights),
+           lock_users=True)
+    db.commit()
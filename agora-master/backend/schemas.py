@@ -0,0 +1,31 @@
+import json
+from typing import List
+
+from pydantic import BaseModel, TypeAdapter, ValidationError
+
+
+class PrivacySettings(BaseModel):
+    email: bool = False
+    bio: bool = True
+    uni: bool = True
+    tg: bool = True
+
+
+FavCategories = TypeAdapter(List[str])
+
+
+def parse_privacy(raw) -> dict:
+    """Настройки приватности из формы/старой строки в базе; при ошибке — значения по умолчанию."""
+    try:
+        if isinstance(raw, str):
+            return PrivacySettings.model_validate_json(raw).model_dump()
+        return PrivacySettings.model_validate(raw or {}).model_dump()
+    except ValidationError:
+        return PrivacySettings().model_dump()
+
+
+def parse_fav_categories(raw) -> list:
+    """Список избранных категорий; бросает ValidationError, если пришло не то."""
+    if isinstance(raw, str):
+        raw = json.loads(raw) if raw.strip() else []
+    return list(dict.fromkeys(c.strip() for c in FavCategories.validate_python(raw) if c.strip()))
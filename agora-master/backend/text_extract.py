@@ -0,0 +1,21 @@
+import PyPDF2
+import docx
+
+
+# вынесено из main.py, чтобы функцию можно было вызывать в отдельных процессах (см. import_materials.py)
+def extract_text_from_file(file_path: str) -> str:
+    text = ""
+    try:
+        if file_path.endswith(".pdf"):
+            with open(f"uploads/{file_path}", "rb") as f:
+                reader = PyPDF2.PdfReader(f)
+                for page in reader.pages[:5]: text += page.extract_text() + "\n"
+        elif file_path.endswith(".docx"):
+            doc = docx.Document(f"uploads/{file_path}")
+            for para in doc.paragraphs: text += para.text + "\n"
+        elif file_path.endswith(".txt"):
+            with open(f"uploads/{file_path}", "r", encoding="utf-8") as f:
+                text = f.read()
+    except Exception as e:
+        print(f"Ошибка чтения файла: {e}")
+    return text[:8000]